@@ -1,61 +1,149 @@
+import logging
 import msgpack
 import polars as pl
-from fastapi import APIRouter, Query, Response
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
 from app.services import ETL, variants, graph
+from app.config import ZSTD_LEVEL, ARROW_IPC_COMPRESSION
 import zstandard as zstd
 import pyarrow as pa
 import pyarrow.ipc as ipc
+import numpy as np
 import io
+import struct
+from typing import Iterable, Iterator, List
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 
-def dataframe_to_arrow_ipc(df: pl.DataFrame) -> bytes:
-    """Convert Polars DataFrame to Arrow IPC bytes.
-    
-    Handles LargeList/LargeString -> List/String conversion for JS compatibility.
-    """
+# Rows per record batch when a table is streamed as Arrow IPC (see /variants)
+ARROW_STREAM_BATCH_ROWS = 64_000
+
+# Compression parameters are resolved once. Each streamed response still needs its own
+# compressor context: bodies are produced in Starlette's threadpool and may interleave.
+_ZSTD_PARAMS = zstd.ZstdCompressionParameters.from_level(ZSTD_LEVEL, threads=-1)
+
+def _narrow_offsets(offsets_buf: pa.Buffer, count: int) -> pa.Buffer:
+    """Narrows a 64-bit Arrow offsets buffer to 32-bit (only the offsets are copied)."""
+    offsets = np.frombuffer(offsets_buf, dtype=np.int64, count=count)
+    if count and offsets[-1] >= 2**31:
+        raise ValueError("Arrow column is too large for 32-bit offsets")
+    return pa.py_buffer(offsets.astype(np.int32))
+
+
+def _to_small_offsets(arr: pa.Array) -> pa.Array:
+    """Converts LargeList/LargeString arrays to List/String, reusing the values buffers."""
+    if pa.types.is_large_string(arr.type):
+        validity, offsets, data = arr.buffers()
+        return pa.Array.from_buffers(
+            pa.string(), len(arr),
+            [validity, _narrow_offsets(offsets, arr.offset + len(arr) + 1), data],
+            null_count=arr.null_count, offset=arr.offset
+        )
+    if pa.types.is_large_list(arr.type):
+        # `values` ignores the slice offset, so the narrowed offsets still index into it
+        child = _to_small_offsets(arr.values)
+        validity, offsets = arr.buffers()[:2]
+        return pa.Array.from_buffers(
+            pa.list_(child.type), len(arr),
+            [validity, _narrow_offsets(offsets, arr.offset + len(arr) + 1)],
+            null_count=arr.null_count, offset=arr.offset, children=[child]
+        )
+    return arr
+
+
+def _js_compatible_table(df: pl.DataFrame) -> pa.Table:
+    """Converts a Polars DataFrame to an Arrow table without Large* offset types."""
     # Convert Polars to Arrow Table
     arrow_table = df.to_arrow()
     
-    # Convert LargeList/LargeString to regular List/String for JS apache-arrow compatibility
-    new_fields = []
-    new_columns = []
-    
-    for i, field in enumerate(arrow_table.schema):
-        column = arrow_table.column(i)
+    # Convert LargeList/LargeString to regular List/String for JS apache-arrow compatibility.
+    # Only the offsets are rewritten; the values buffers are shared with the original table.
+    needs_cast = any(
+        pa.types.is_large_list(field.type) or pa.types.is_large_string(field.type)
+        for field in arrow_table.schema
+    )
+    if needs_cast:
+        new_columns = []
+        for column in arrow_table.columns:
+            chunks = [_to_small_offsets(chunk) for chunk in column.chunks]
+            new_type = chunks[0].type if chunks else _to_small_offsets(pa.array([], type=column.type)).type
+            new_columns.append(pa.chunked_array(chunks, type=new_type))
         
-        if pa.types.is_large_list(field.type):
-            # Convert LargeList to List
-            value_type = field.type.value_type
-            # If value type is also Large*, convert it too
-            if pa.types.is_large_string(value_type):
-                value_type = pa.string()
-            new_type = pa.list_(value_type)
-            new_field = pa.field(field.name, new_type)
-            # Cast the column
-            new_column = column.cast(new_type)
-            new_fields.append(new_field)
-            new_columns.append(new_column)
-        elif pa.types.is_large_string(field.type):
-            # Convert LargeString to String
-            new_field = pa.field(field.name, pa.string())
-            new_column = column.cast(pa.string())
-            new_fields.append(new_field)
-            new_columns.append(new_column)
-        else:
-            new_fields.append(field)
-            new_columns.append(column)
+        arrow_table = pa.table(new_columns, names=arrow_table.column_names)
+    return arrow_table
+
+def dataframes_to_arrow_ipc(*dfs: pl.DataFrame, compression: str = ARROW_IPC_COMPRESSION) -> List[memoryview]:
+    """Convert Polars DataFrames to Arrow IPC streams, one per frame.
     
-    # Create new table with converted types
-    new_schema = pa.schema(new_fields)
-    arrow_table = pa.table(dict(zip([f.name for f in new_fields], new_columns)), schema=new_schema)
+    Handles LargeList/LargeString -> List/String conversion for JS compatibility.
+    When `compression` is set ("lz4"/"zstd"), Arrow compresses each buffer itself.
+    All streams are written back to back into one Arrow-owned buffer (no BytesIO copy)
+    and returned as zero-copy slices of it.
+    """
+    sink = pa.BufferOutputStream()
+    options = ipc.IpcWriteOptions(compression=compression)
+    bounds = []
+    for df in dfs:
+        arrow_table = _js_compatible_table(df)
+        start = sink.tell()
+        with ipc.new_stream(sink, arrow_table.schema, options=options) as writer:
+            writer.write_table(arrow_table)
+        bounds.append((start, sink.tell()))
     
-    # Serialize to IPC format
-    sink = io.BytesIO()
-    with ipc.new_stream(sink, arrow_table.schema) as writer:
-        writer.write_table(arrow_table)
+    # memoryview exposes the buffer to msgpack without converting it to bytes
+    view = memoryview(sink.getvalue())
+    return [view[start:end] for start, end in bounds]
+
+def iter_arrow_ipc(df: pl.DataFrame, max_chunksize: int = ARROW_STREAM_BATCH_ROWS,
+                   compression: str = ARROW_IPC_COMPRESSION) -> Iterator[bytes]:
+    """Yields `df` as an Arrow IPC stream, one record batch at a time.
     
-    return sink.getvalue()
+    Every chunk holds one record batch; the first also carries the schema message (the writer
+    only emits it with the first batch) and a final chunk holds the end-of-stream marker.
+    The client can start decoding before the last batch is written.
+    """
+    arrow_table = _js_compatible_table(df)
+    sink = io.BytesIO()
+    options = ipc.IpcWriteOptions(compression=compression)
+    with ipc.new_stream(sink, arrow_table.schema, options=options) as writer:
+        for batch in arrow_table.to_batches(max_chunksize=max_chunksize):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate(0)
+    # End-of-stream marker written when the writer closes
+    yield sink.getvalue()
+
+def _msgpack_bin_header(size: int) -> bytes:
+    """MsgPack bin8/bin16/bin32 header (msgpack.Packer has no public helper for it)."""
+    if size < 2**8:
+        return struct.pack(">BB", 0xc4, size)
+    if size < 2**16:
+        return struct.pack(">BH", 0xc5, size)
+    return struct.pack(">BI", 0xc6, size)
+
+def pack_envelope(payload: dict) -> List[bytes]:
+    """MsgPack-encodes a flat map as a list of parts; binary fields are passed through uncopied."""
+    packer = msgpack.Packer(use_bin_type=True)
+    parts = [packer.pack_map_header(len(payload))]
+    for key, value in payload.items():
+        parts.append(packer.pack(key))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            parts.append(_msgpack_bin_header(len(value)))
+            parts.append(value)
+        else:
+            parts.append(packer.pack(value))
+    return parts
+
+def zstd_stream(parts: Iterable[bytes], size: int) -> Iterator[bytes]:
+    """Compresses `parts` into a single zstd frame, yielding output as it is produced."""
+    cobj = zstd.ZstdCompressor(compression_params=_ZSTD_PARAMS).compressobj(size=size)
+    for part in parts:
+        chunk = cobj.compress(part)
+        if chunk:
+            yield chunk
+    yield cobj.flush()
 
 @router.post("/data")
 async def get_graph_data(
@@ -69,27 +157,27 @@ async def get_graph_data(
     max_mean_time: int = Query(None),
     target_coverage: float = Query(0.95),
 ):
-    print("=" * 80)
-    print("🌐 [API] POST /api/graph/data called (Arrow IPC + MsgPack + Zstd)")
-    print("=" * 80)
+    log.debug("POST /api/graph/data called (Arrow IPC + MsgPack + Zstd)")
     
     try:
+        # Read before the ETL: if the cache file is refreshed meanwhile, this key is never asked for again
+        data_version = ETL.cached_data_version()
+        
         # 1. ETL (Load + Filter + Enrich)
-        print("\n📦 [API] Step 1: Running ETL pipeline...")
         lf = ETL.get_lazyframe(start_date, end_date) 
-        print("✅ [API] Step 1: ETL complete.\n")
         
         # 2. Variants Calculation
-        print("📦 [API] Step 2: Calculating variants...")
         pareto_df, all_vars_df, start_nodes, end_nodes = variants.get_variants_logic(
             lf, target_coverage
         )
-        print(f"✅ [API] Step 2: Variants complete. Pareto DF shape: {pareto_df.shape}\n")
+        log.debug("Variants complete. Pareto DF shape: %s", pareto_df.shape)
         
         # 3. Graph Generation
-        print("📦 [API] Step 3: Generating graph...")
-        graph_df = graph.generate_graph_from_variants(
+        # The pareto set is fully determined by the data version, the window and the coverage
+        graph_key = (data_version, start_date, end_date, target_coverage) if data_version is not None else None
+        graph_df = graph.generate_graph_cached(
             pareto_df, 
+            graph_key,
             weight_metric=weight_metric,
             time_unit=time_unit,
             min_cases=min_cases,
@@ -97,17 +185,10 @@ async def get_graph_data(
             min_mean_time=min_mean_time,
             max_mean_time=max_mean_time
         )
-        print(f"✅ [API] Step 3: Graph generation complete. Edge DF shape: {graph_df.shape}\n")
+        log.debug("Graph generation complete. Edge DF shape: %s", graph_df.shape)
         
         # 4. Serialization - Convert to Arrow IPC format
-        print("📦 [API] Step 4: Serializing to Arrow IPC...")
-        
-        # Convert DataFrames to Arrow IPC bytes
-        graph_arrow = dataframe_to_arrow_ipc(graph_df)
-        variants_arrow = dataframe_to_arrow_ipc(all_vars_df)
-        
-        print(f"   [DEBUG] Graph Arrow size: {len(graph_arrow) / 1024:.2f} KB")
-        print(f"   [DEBUG] Variants Arrow size: {len(variants_arrow) / 1024:.2f} KB")
+        graph_arrow, variants_arrow = dataframes_to_arrow_ipc(graph_df, all_vars_df)
         
         # Bundle with msgpack (Arrow IPC bytes + simple lists)
         payload = {
@@ -118,24 +199,47 @@ async def get_graph_data(
             "targetCoverage": target_coverage,
         }
         
-        packed_data = msgpack.packb(payload, use_bin_type=True)
+        parts = pack_envelope(payload)
+        payload_size = sum(len(part) for part in parts)
         
-        # Compress with zstd
-        cctx = zstd.ZstdCompressor(level=3)
-        compressed_data = cctx.compress(packed_data)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Arrow sizes: graph %.2f KB, variants %.2f KB; payload %.2f KB",
+                len(graph_arrow) / 1024, len(variants_arrow) / 1024, payload_size / 1024
+            )
         
-        print(f"   [DEBUG] Uncompressed size: {len(packed_data) / 1024:.2f} KB")
-        print(f"   [DEBUG] Compressed size: {len(compressed_data) / 1024:.2f} KB")
-        print("=" * 80)
-        print("✅ [API] Request completed successfully!")
-        print("=" * 80)
+        # Stream the envelope (chunked transfer) instead of joining it into one blob first.
+        # It is zstd-compressed on the fly, unless Arrow already compressed the IPC buffers.
+        if ARROW_IPC_COMPRESSION:
+            return StreamingResponse(iter(parts), media_type="application/x-arrow-msgpack")
+        return StreamingResponse(
+            zstd_stream(parts, payload_size), media_type="application/x-arrow-msgpack-zstd"
+        )
+
+    except Exception:
+        log.exception("POST /api/graph/data failed")
+        raise
+
+@router.post("/variants")
+async def get_variants_arrow(
+    start_date: str = Query(None),
+    end_date: str = Query(None),
+    target_coverage: float = Query(0.95),
+    pareto_only: bool = Query(False, description="Only the variants inside the target coverage"),
+):
+    """Variants table as a plain Arrow IPC stream (no MsgPack envelope), sent batch by batch."""
+    log.debug("POST /api/graph/variants called (Arrow IPC stream)")
+    
+    try:
+        lf = ETL.get_lazyframe(start_date, end_date)
+        pareto_df, all_vars_df, _, _ = variants.get_variants_logic(lf, target_coverage)
+        variants_df = pareto_df if pareto_only else all_vars_df
+        log.debug("Streaming %d variants", variants_df.height)
         
-        return Response(content=compressed_data, media_type="application/x-arrow-msgpack-zstd")
-
-    except Exception as e:
-        print("=" * 80)
-        print(f"❌ [API] ERROR: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        print("=" * 80)
-        raise e
\ No newline at end of file
+        return StreamingResponse(
+            iter_arrow_ipc(variants_df), media_type="application/vnd.apache.arrow.stream"
+        )
+
+    except Exception:
+        log.exception("POST /api/graph/variants failed")
+        raise
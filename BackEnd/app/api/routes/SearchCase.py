@@ -1,7 +1,10 @@
+import logging
+from typing import Any, Dict
 from fastapi import APIRouter, Query, HTTPException
 from app.services import ETL, searchCase
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 
 @router.get("/search")
 async def search_case_by_id(
@@ -9,52 +12,40 @@ async def search_case_by_id(
     start_date: str = Query(None),
     end_date: str = Query(None),
     include_global_stats: bool = Query(True, description="Include comparison with global statistics")
-):
+) -> Dict[str, Any]:
     """
     Search for a specific case by its ID and return its path and timing information.
     Optionally compares the case to global statistics.
     """
-    print("=" * 80)
-    print("🌐 [API] GET /api/search/search called")
-    print(f"   [API] Parameters:")
-    print(f"         case_id={case_id}")
-    print(f"         start_date={start_date}, end_date={end_date}")
-    print(f"         include_global_stats={include_global_stats}")
-    print("=" * 80)
+    log.debug(
+        "GET /api/search called: case_id=%s, start_date=%s, end_date=%s, include_global_stats=%s",
+        case_id, start_date, end_date, include_global_stats
+    )
     
     try:
+        # Read before the ETL: if the cache file is refreshed meanwhile, this key is never asked for again
+        data_version = ETL.cached_data_version()
+        
         # 1. ETL (Load + Filter + Enrich)
-        print("\n📦 [API] Step 1: Running ETL pipeline...")
         lf = ETL.get_lazyframe(start_date, end_date)
-        print("✅ [API] Step 1: ETL complete.\n")
-        
-        # 2. Get global context if needed
-        df_global_context = None
-        if include_global_stats:
-            print("📦 [API] Step 2: Collecting global context for comparison...")
-            df_global_context = lf.collect()
-            print(f"✅ [API] Step 2: Global context collected. Shape: {df_global_context.shape}\n")
         
-        # 3. Search for the case
-        print(f"📦 [API] Step 3: Searching for case_id={case_id}...")
-        result = searchCase.search_case_logic(lf, case_id, df_global_context)
+        # 2. Search for the case (global stats are collected in the same pass, then cached per
+        # data version and window; without a fresh ETL cache file nothing is reused)
+        durations_key = (data_version, start_date, end_date) if data_version is not None else None
+        result = searchCase.search_case_logic(
+            lf, case_id, include_global_stats, cache_key=durations_key
+        )
         
         if result is None:
-            print(f"⚠️ [API] Case {case_id} not found.")
+            log.info("Case %s not found", case_id)
             raise HTTPException(status_code=404, detail=f"Case with ID {case_id} not found")
         
-        print(f"✅ [API] Step 3: Case found with {len(result['nodes'])} nodes.\n")
-        
-        print("=" * 80)
-        print("✅ [API] Request completed successfully!")
-        print("=" * 80)
+        log.debug("Case %s found with %d nodes", case_id, len(result['nodes']))
         
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        print("=" * 80)
-        print(f"❌ [API] ERROR: {type(e).__name__}: {e}")
-        print("=" * 80)
+        log.exception("GET /api/search failed")
         raise HTTPException(status_code=500, detail=str(e))
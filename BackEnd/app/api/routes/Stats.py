@@ -1,52 +1,39 @@
+import logging
+from typing import Any, Dict
 from fastapi import APIRouter, Query, HTTPException
 from app.services import ETL, stats
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 
 @router.get("/global")
 async def get_global_stats(
     start_date: str = Query(None),
     end_date: str = Query(None)
-):
+) -> Dict[str, Any]:
     """
     Get global statistics for all cases including:
     - Total duration distribution histogram
     - Case length (steps) distribution histogram
     """
-    print("=" * 80)
-    print("🌐 [API] GET /api/stats/global called")
-    print(f"   [API] Parameters:")
-    print(f"         start_date={start_date}, end_date={end_date}")
-    print("=" * 80)
+    log.debug("GET /api/stats/global called: start_date=%s, end_date=%s", start_date, end_date)
     
     try:
         # 1. ETL (Load + Filter + Enrich)
-        print("\n📦 [API] Step 1: Running ETL pipeline...")
         lf = ETL.get_lazyframe(start_date, end_date)
-        print("✅ [API] Step 1: ETL complete.\n")
         
-        # 2. Collect DataFrame
-        print("📦 [API] Step 2: Collecting DataFrame...")
-        df = lf.collect()
-        print(f"✅ [API] Step 2: DataFrame collected. Shape: {df.shape}\n")
-        
-        # 3. Calculate global statistics
-        print("📦 [API] Step 3: Calculating global statistics...")
-        result = stats.get_global_statistics(df)
-        print(f"✅ [API] Step 3: Statistics calculated.")
-        print(f"   [API] Duration histogram bins: {len(result['total_time']['bins'])}")
-        print(f"   [API] Steps histogram bins: {len(result['steps']['bins'])}\n")
-        
-        print("=" * 80)
-        print("✅ [API] Request completed successfully!")
-        print("=" * 80)
+        # 2. Calculate global statistics (aggregated per case straight from the lazy frame)
+        result = stats.get_global_statistics(lf)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Statistics calculated: %d duration bins, %d steps bins",
+                len(result['total_time']['bins']), len(result['steps']['bins'])
+            )
         
         return result
         
     except Exception as e:
-        print("=" * 80)
-        print(f"❌ [API] ERROR: {type(e).__name__}: {e}")
-        print("=" * 80)
+        log.exception("GET /api/stats/global failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -56,41 +43,26 @@ async def get_edge_stats(
     target: str = Query(..., description="Target activity name"),
     start_date: str = Query(None),
     end_date: str = Query(None)
-):
+) -> Dict[str, Any]:
     """
     Get duration distribution statistics for a specific edge (transition between two activities).
     Returns histogram data for the edge's duration distribution.
     """
-    print("=" * 80)
-    print("🌐 [API] GET /api/stats/edge called")
-    print(f"   [API] Parameters:")
-    print(f"         source={source}, target={target}")
-    print(f"         start_date={start_date}, end_date={end_date}")
-    print("=" * 80)
+    log.debug(
+        "GET /api/stats/edge called: source=%s, target=%s, start_date=%s, end_date=%s",
+        source, target, start_date, end_date
+    )
     
     try:
         # 1. ETL (Load + Filter + Enrich)
-        print("\n📦 [API] Step 1: Running ETL pipeline...")
         lf = ETL.get_lazyframe(start_date, end_date)
-        print("✅ [API] Step 1: ETL complete.\n")
         
-        # 2. Collect DataFrame
-        print("📦 [API] Step 2: Collecting DataFrame...")
-        df = lf.collect()
-        print(f"✅ [API] Step 2: DataFrame collected. Shape: {df.shape}\n")
-        
-        # 3. Calculate edge statistics
-        print(f"📦 [API] Step 3: Calculating statistics for edge '{source}' -> '{target}'...")
-        result = stats.get_single_edge_statistics(df, source, target)
-        print(f"✅ [API] Step 3: Edge statistics calculated.")
-        print(f"   [API] Histogram bins: {len(result['bins'])}\n")
+        # 2. Calculate edge statistics (the lazy frame is projected and collected inside)
+        result = stats.get_single_edge_statistics(lf, source, target)
+        log.debug("Edge statistics calculated: %d histogram bins", len(result['bins']))
         
         if not result['bins']:
-            print(f"⚠️ [API] No data found for edge '{source}' -> '{target}'")
-        
-        print("=" * 80)
-        print("✅ [API] Request completed successfully!")
-        print("=" * 80)
+            log.info("No data found for edge '%s' -> '%s'", source, target)
         
         return {
             "source": source,
@@ -99,7 +71,5 @@ async def get_edge_stats(
         }
         
     except Exception as e:
-        print("=" * 80)
-        print(f"❌ [API] ERROR: {type(e).__name__}: {e}")
-        print("=" * 80)
+        log.exception("GET /api/stats/edge failed")
         raise HTTPException(status_code=500, detail=str(e))
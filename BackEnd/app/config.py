@@ -1 +1,21 @@
-DATABASE_URL = "postgresql://mhgh0st:MHgh.982@db:5432/postgres"
\ No newline at end of file
+import os
+
+DATABASE_URL = "postgresql://mhgh0st:MHgh.982@db:5432/postgres"
+
+# سطح فشرده‌سازی zstd برای پاسخ‌های API (۱ تا ۵ برای API های تعاملی مناسب است)
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "1"))
+
+# فشرده‌سازی داخلی Arrow IPC ("lz4" یا "zstd"). اگر تنظیم شود، مرحله zstd روی کل پاسخ حذف می‌شود.
+# کلاینت باید از Arrow IPC فشرده پشتیبانی کند؛ پیش‌فرض خاموش است.
+ARROW_IPC_COMPRESSION = os.getenv("ARROW_IPC_COMPRESSION") or None
+
+# کش خروجی دیتابیس به صورت فایل Arrow IPC (ترجیحاً روی tmpfs) و مدت اعتبار آن بر حسب ثانیه (۰ = غیرفعال)
+ETL_CACHE_DIR = os.getenv("ETL_CACHE_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp")
+ETL_CACHE_TTL = int(os.getenv("ETL_CACHE_TTL", "300"))
+
+# آدرس‌های مجاز فرانت‌اند برای CORS (با کاما جدا می‌شوند). wildcard همراه با credentials مجاز نیست.
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
+    if origin.strip()
+]
@@ -1,18 +1,90 @@
+import logging
 import polars as pl
-from app.config import DATABASE_URL
+from app.config import DATABASE_URL, ETL_CACHE_DIR, ETL_CACHE_TTL
+import hashlib
 import os
+import time
+from datetime import datetime, timezone
 from typing import Optional
 
 CPU_CORES = os.cpu_count() or 1
 PARTITIONS = min(CPU_CORES, 8)
 
+log = logging.getLogger(__name__)
 
-def load_data_from_db(query : str = "SELECT \"case_id\", \"activity\", \"timestamp\" FROM test_1"):
+BASE_QUERY = "SELECT \"case_id\", \"activity\", \"timestamp\" FROM test_1"
+
+
+def _cache_path(query: str) -> str:
+    key = hashlib.blake2b(query.encode()).hexdigest()[:16]
+    return os.path.join(ETL_CACHE_DIR, f"etl_{key}.arrow")
+
+
+def _fresh_cache_path(query: str) -> Optional[str]:
+    """Returns the cache file for `query` if it exists and is younger than the TTL."""
+    cache_path = _cache_path(query)
+    if ETL_CACHE_TTL > 0 and os.path.exists(cache_path):
+        if time.time() - os.path.getmtime(cache_path) < ETL_CACHE_TTL:
+            return cache_path
+    return None
+
+
+def cached_data_version() -> Optional[float]:
+    """Modification time of the fresh full-table cache file, or None when there is none.
+    
+    While it is unchanged, every time window is filtered from the very same data.
+    """
+    cache_path = _fresh_cache_path(BASE_QUERY)
+    if cache_path is None:
+        return None
+    try:
+        return os.path.getmtime(cache_path)
+    except OSError:
+        return None
+
+
+def parse_window_bound(value: str) -> datetime:
+    """Parses a start/end date to the naive UTC datetime the cast Timestamp column is compared with."""
+    bound = datetime.fromisoformat(value)
+    if bound.tzinfo is not None:
+        bound = bound.astimezone(timezone.utc).replace(tzinfo=None)
+    return bound
+
+
+def _sql_timestamp_literal(value: str) -> str:
+    """SQL literal for `value` read the way apply_time_filter compares it (as UTC wall time).
+    
+    The explicit +00 offset keeps a timestamptz column from using the session time zone;
+    a timestamp column ignores the offset and compares the wall time, as Polars does.
+    """
+    # Dates are parsed first, so only a formatted datetime ever reaches the SQL text
+    return f"'{parse_window_bound(value).isoformat(sep=' ')}+00'"
+
+
+def build_time_window_query(start_date: Optional[str], end_date: Optional[str]) -> str:
+    """BASE_QUERY with the time window as a WHERE clause, so Postgres only sends matching rows."""
+    conditions = []
+    if start_date:
+        conditions.append(f"\"timestamp\" >= {_sql_timestamp_literal(start_date)}")
+    if end_date:
+        conditions.append(f"\"timestamp\" <= {_sql_timestamp_literal(end_date)}")
+    if not conditions:
+        return BASE_QUERY
+    return f"{BASE_QUERY} WHERE {' AND '.join(conditions)}"
+
+
+def load_data_from_db(query : str = BASE_QUERY):
     """
     خواندن فوق‌سریع دیتا از دیتابیس با استفاده از ConnectorX
+    نتیجه‌ی جدول کامل (BASE_QUERY) به صورت فایل Arrow IPC کش می‌شود تا درخواست‌های بعدی فقط یک scan روی حافظه باشند.
     """
-    print("🚀 [ETL] load_data_from_db: Fetching data from DB using ConnectorX...")
-    print(f"   [ETL] Query: {query}")
+    cache_path = _fresh_cache_path(query)
+    if cache_path:
+        log.debug("load_data_from_db: Using cached Arrow file: %s", cache_path)
+        return pl.scan_ipc(cache_path)
+    cache_path = _cache_path(query)
+
+    log.info("load_data_from_db: Fetching data from DB using ConnectorX: %s", query)
     
     # 1. خواندن دیتا با موتور connectorx
     # این دستور دیتا را مستقیم به مموری Arrow می‌آورد
@@ -24,17 +96,35 @@ def load_data_from_db(query : str = "SELECT \"case_id\", \"activity\", \"timesta
         partition_num= PARTITIONS            
     )
     
-    print(f"✅ [ETL] load_data_from_db: Loaded {df.shape[0]} rows, {df.shape[1]} columns.")
-    print(f"   [ETL] Columns: {df.columns}")
+    # فعالیت‌ها به صورت Categorical ذخیره می‌شوند تا مقایسه و group_by روی کد عددی انجام شود
+    df = df.with_columns(pl.col('activity').cast(pl.Categorical))
+    
+    log.debug("load_data_from_db: Loaded %d rows, columns %s", df.height, df.columns)
+
+    # 2. فقط جدول کامل کش می‌شود؛ بازه‌های زمانی از همان فایل فیلتر می‌شوند و هر بازه
+    # یک کپی کامل جدا (روی tmpfs، یعنی RAM) نمی‌سازد
+    if ETL_CACHE_TTL > 0 and query == BASE_QUERY:
+        # نوشتن کش بدون فشرده‌سازی تا memory_map بدون کپی انجام شود؛ rename اتمیک است
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            df.write_ipc(tmp_path, compression="uncompressed")
+            os.replace(tmp_path, cache_path)
+            log.debug("Cached result to %s", cache_path)
+        except OSError as e:
+            log.warning("Could not write cache file: %s", e)
+            # A partly written file (e.g. ENOSPC on /dev/shm) must not keep holding space
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
     
     return df.lazy()
 
 
 def standardize_columns(lf: pl.LazyFrame) -> pl.LazyFrame:
-    """Renames first 3 columns to standard CaseID, Activity, Timestamp and casts time."""
-    print("🔄 [ETL] standardize_columns: Renaming columns...")
+    """Renames first 3 columns to standard CaseID, Activity, Timestamp and casts activity and time."""
     current_cols = lf.collect_schema().names()
-    print(f"   [ETL] Current columns: {current_cols}")
+    log.debug("standardize_columns: Current columns: %s", current_cols)
     
     if len(current_cols) >= 3:
         lf = lf.rename({
@@ -43,61 +133,54 @@ def standardize_columns(lf: pl.LazyFrame) -> pl.LazyFrame:
             'timestamp': 'Timestamp'
         })
     
-    lf = lf.with_columns(pl.col('Timestamp').cast(pl.Datetime))
-    print("✅ [ETL] standardize_columns: Done.")
+    # Activity is Categorical (a no-op when the loader already cast it)
+    lf = lf.with_columns([
+        pl.col('Activity').cast(pl.Categorical),
+        pl.col('Timestamp').cast(pl.Datetime)
+    ])
     return lf
 
 def enrich_event_log(lf: pl.LazyFrame) -> pl.LazyFrame:
-    """Adds ranking, case start time, and seconds from start."""
-    print("🔄 [ETL] enrich_event_log: Adding ranking and timing columns...")
-    lf = lf.with_columns(pl.col('Timestamp').cast(pl.Datetime))
-    # Sorting is essential for rank and duration calc
+    """Sorts events by case and time and adds seconds from the case start."""
+    # Timestamp is already cast to Datetime in standardize_columns
+    # Sorting is essential: variant paths, edges and case lookups read events in this order
     lf = lf.sort(['CaseID', 'Timestamp'])
     
-    lf = lf.with_columns([
-        pl.col('Timestamp').rank('ordinal').over('CaseID').alias('Event_Rank'),
-        pl.col('Timestamp').min().over('CaseID').alias('Case_Start_Time')
-    ])
-    
-    lf = lf.with_columns([
-        pl.col('Event_Rank').max().over('CaseID').alias('Max_Rank'),
-        (pl.col('Timestamp') - pl.col('Case_Start_Time')).dt.total_seconds().alias('Seconds_From_Start')
-    ])
-    
-    print("✅ [ETL] enrich_event_log: Done.")
+    lf = lf.with_columns(
+        (pl.col('Timestamp') - pl.col('Timestamp').min().over('CaseID')).dt.total_seconds().alias('Seconds_From_Start')
+    )
     return lf
 
 
 def apply_time_filter(lf: pl.LazyFrame, start_date: Optional[str], end_date: Optional[str]) -> pl.LazyFrame:
     """Filters the event log based on timestamp."""
-    print(f"🔄 [ETL] apply_time_filter: start_date={start_date}, end_date={end_date}")
+    log.debug("apply_time_filter: start_date=%s, end_date=%s", start_date, end_date)
     
+    # Parsed in Python so the plan gets typed datetime constants, not a string-parse node
     if start_date:
-        lf = lf.filter(pl.col('Timestamp') >= pl.lit(start_date).str.to_datetime())
-        print(f"   [ETL] Applied start_date filter: >= {start_date}")
+        lf = lf.filter(pl.col('Timestamp') >= parse_window_bound(start_date))
     if end_date:
-        lf = lf.filter(pl.col('Timestamp') <= pl.lit(end_date).str.to_datetime())
-        print(f"   [ETL] Applied end_date filter: <= {end_date}")
-    
-    print("✅ [ETL] apply_time_filter: Done.")
+        lf = lf.filter(pl.col('Timestamp') <= parse_window_bound(end_date))
     return lf
 
 
 def get_lazyframe(start_date: Optional[str], end_date: Optional[str]) -> pl.LazyFrame:
     """Standard pipeline to get the prepared LazyFrame."""
-    print("=" * 60)
-    print("🚀 [ETL] get_lazyframe: Starting ETL pipeline...")
-    print(f"   [ETL] Parameters: start_date={start_date}, end_date={end_date}")
-    
-    lf = load_data_from_db()
+    log.debug("get_lazyframe: start_date=%s, end_date=%s", start_date, end_date)
+
+    # Push the time window into SQL, unless the full table is already cached locally
+    # (then filtering the cached scan is cheaper than a new round trip to the DB)
+    push_to_db = bool(start_date or end_date) and _fresh_cache_path(BASE_QUERY) is None
+    if push_to_db:
+        lf = load_data_from_db(build_time_window_query(start_date, end_date))
+    else:
+        lf = load_data_from_db()
     lf = standardize_columns(lf)
     
-    print("🔄 [ETL] Filtering null timestamps...")
+    # Events without a timestamp cannot be ordered within their case
     lf = lf.filter(pl.col('Timestamp').is_not_null())
     
-    lf = apply_time_filter(lf, start_date, end_date)
+    if not push_to_db:
+        lf = apply_time_filter(lf, start_date, end_date)
     lf = enrich_event_log(lf)
-    
-    print("✅ [ETL] get_lazyframe: ETL pipeline complete.")
-    print("=" * 60)
     return lf
\ No newline at end of file
@@ -1,92 +1,91 @@
+import logging
 import polars as pl
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from typing import Hashable, Optional
 from app.services.utils import format_seconds_to_days_expr
 
+log = logging.getLogger(__name__)
+
+# Column layout of the edge DataFrame returned by generate_graph_from_variants
+EDGE_SCHEMA = {
+    'Source_Activity': pl.Utf8,
+    'Target_Activity': pl.Utf8,
+    'Mean_Duration_Seconds': pl.Float64,
+    'Tooltip_Total_Time': pl.Utf8,
+    'Tooltip_Mean_Time': pl.Utf8,
+    'Weight_Value': pl.Float64,
+    'Edge_Label': pl.Utf8,
+    'Case_Count': pl.UInt32,
+}
+
+GRAPH_CACHE_SIZE = 32
+_GRAPH_CACHE: "OrderedDict[tuple, pl.DataFrame]" = OrderedDict()
+
 def generate_graph_from_variants(variants_df: pl.DataFrame, weight_metric: str = 'cases', time_unit: str = 'd', 
 min_cases: Optional[int] = None, max_cases: Optional[int] = None, min_mean_time: Optional[int] = None, max_mean_time: Optional[int] = None) -> pl.DataFrame:
     """Generates the DFG (Directly Follows Graph) edges from variants."""
-    print("=" * 60)
-    print("🚀 [GRAPH] generate_graph_from_variants: Starting...")
-    print(f"   [GRAPH] Parameters: weight_metric={weight_metric}, time_unit={time_unit}")
-    print(f"   [GRAPH] Filters: min_cases={min_cases}, max_cases={max_cases}, min_mean_time={min_mean_time}, max_mean_time={max_mean_time}")
-    print(f"   [GRAPH] Input DataFrame shape: {variants_df.shape}")
-    print(f"   [GRAPH] Input DataFrame columns: {variants_df.columns}")
+    log.debug(
+        "generate_graph_from_variants: weight_metric=%s, time_unit=%s, min_cases=%s, max_cases=%s, "
+        "min_mean_time=%s, max_mean_time=%s, input shape=%s",
+        weight_metric, time_unit, min_cases, max_cases, min_mean_time, max_mean_time, variants_df.shape
+    )
     
     if variants_df.is_empty():
-        print("⚠️ [GRAPH] Input DataFrame is empty. Returning [].")
-        return []
-
-    # Debug: Check list lengths for Variant_Path and Avg_Timings
-    print("🔍 [GRAPH] Checking list lengths for Variant_Path and Avg_Timings...")
-    try:
-        sample_df = variants_df.head(5).select([
-            pl.col('Variant_Path').list.len().alias('Variant_Path_len'),
-            pl.col('Avg_Timings').list.len().alias('Avg_Timings_len')
-        ])
-        print(f"   [GRAPH] Sample list lengths (first 5 rows):\n{sample_df}")
-        
-        # Check for mismatched lengths
+        log.debug("Input DataFrame is empty. Returning an empty edge DataFrame.")
+        return pl.DataFrame(schema=EDGE_SCHEMA)
+
+    # Diagnostics materialize data, so they only run when debug logging is on
+    if log.isEnabledFor(logging.DEBUG):
         mismatch_count = variants_df.select(
             (pl.col('Variant_Path').list.len() != pl.col('Avg_Timings').list.len()).sum().alias('mismatch_count')
         ).item()
-        print(f"   [GRAPH] Rows with mismatched Variant_Path/Avg_Timings lengths: {mismatch_count}")
-        
         if mismatch_count > 0:
-            print("⚠️ [GRAPH] WARNING: Found rows with mismatched list lengths! This will cause explode to fail.")
-            # Show some examples
-            mismatched = variants_df.filter(
-                pl.col('Variant_Path').list.len() != pl.col('Avg_Timings').list.len()
-            ).head(3).select([
-                pl.col('Variant_Path').list.len().alias('Variant_Path_len'),
-                pl.col('Avg_Timings').list.len().alias('Avg_Timings_len'),
-                pl.col('Frequency')
-            ])
-            print(f"   [GRAPH] Sample mismatched rows:\n{mismatched}")
-    except Exception as e:
-        print(f"❌ [GRAPH] Error checking list lengths: {e}")
-
-    print("🔄 [GRAPH] Creating edges by shifting lists...")
-    # Create edges by shifting lists
-    q = variants_df.lazy().select([
-        pl.col('Frequency'),
-        pl.col('Variant_Path').list.slice(0, length=pl.col('Variant_Path').list.len() - 1).alias('Source'),
-        pl.col('Variant_Path').list.slice(1, length=pl.col('Variant_Path').list.len() - 1).alias('Target'),
-        pl.col('Avg_Timings').list.slice(0, length=pl.col('Avg_Timings').list.len() - 1).alias('Source_Time'),
-        pl.col('Avg_Timings').list.slice(1, length=pl.col('Avg_Timings').list.len() - 1).alias('Target_Time'),
-    ])
+            log.warning("%d rows have mismatched Variant_Path/Avg_Timings lengths; explode will fail.", mismatch_count)
 
-    print("🔄 [GRAPH] Exploding columns ['Source', 'Target', 'Source_Time', 'Target_Time']...")
-    try:
-        q = q.explode(['Source', 'Target', 'Source_Time', 'Target_Time'])
-        print("✅ [GRAPH] Explode successful.")
-    except Exception as e:
-        print(f"❌ [GRAPH] Explode FAILED: {e}")
-        raise
+    # Create edges with one flat explode: each activity is paired with the next row,
+    # and pairs that cross into the next variant are dropped
+    q = (
+        variants_df.lazy()
+        .select(['Frequency', 'Variant_Path', 'Avg_Timings'])
+        .with_row_index('Variant_ID')
+        .explode(['Variant_Path', 'Avg_Timings'])
+        .with_columns([
+            pl.col('Variant_Path').shift(-1).alias('Target'),
+            pl.col('Avg_Timings').shift(-1).alias('Target_Time'),
+            pl.col('Variant_ID').shift(-1).alias('Next_Variant_ID')
+        ])
+        .filter(pl.col('Next_Variant_ID') == pl.col('Variant_ID'))
+        .rename({'Variant_Path': 'Source', 'Avg_Timings': 'Source_Time'})
+    )
 
     q = q.with_columns((pl.col('Target_Time') - pl.col('Source_Time')).alias('Duration'))
-    print("🔄 [GRAPH] Calculated Duration column.")
 
-    # Aggregation
-    print("🔄 [GRAPH] Aggregating edges...")
+    # Aggregation (the mean reuses both sums, so CSE computes each of them once)
+    case_count = pl.col('Frequency').sum()
+    total_duration = (pl.col('Duration') * pl.col('Frequency')).sum()
     edges_agg = q.group_by(['Source', 'Target']).agg([
-        pl.col('Frequency').sum().alias('Case_Count'),
-        (pl.col('Duration') * pl.col('Frequency')).sum().alias('Total_Duration_Seconds')
+        case_count.alias('Case_Count'),
+        total_duration.alias('Total_Duration_Seconds'),
+        (total_duration / case_count).alias('Mean_Duration_Seconds')
     ])
 
-    edges_agg = edges_agg.with_columns(
-        (pl.col('Total_Duration_Seconds') / pl.col('Case_Count')).alias('Mean_Duration_Seconds')
-    )
-    print("✅ [GRAPH] Aggregation complete.")
+    # Apply filters before formatting, so dropped edges never get their labels built
+    if min_cases is not None:
+        edges_agg = edges_agg.filter(pl.col('Case_Count') >= min_cases)
+    if max_cases is not None:
+        edges_agg = edges_agg.filter(pl.col('Case_Count') <= max_cases)
+    if min_mean_time is not None:
+        edges_agg = edges_agg.filter(pl.col('Mean_Duration_Seconds') >= min_mean_time)
+    if max_mean_time is not None:
+        edges_agg = edges_agg.filter(pl.col('Mean_Duration_Seconds') <= max_mean_time)
 
     # Formatting
-    print("🔄 [GRAPH] Formatting tooltip columns...")
-    edges_agg = edges_agg.with_columns([
+    output_exprs = [
         format_seconds_to_days_expr('Total_Duration_Seconds').alias('Tooltip_Total_Time'),
         format_seconds_to_days_expr('Mean_Duration_Seconds').alias('Tooltip_Mean_Time')
-    ])
+    ]
 
     # Weight Metric Logic
-    print(f"🔄 [GRAPH] Applying weight metric: {weight_metric}")
     if weight_metric == 'mean_time':
         divisor_map = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
         unit_label_map = {'s': 'ثانیه', 'm': 'دقیقه', 'h': 'ساعت', 'd': 'روز', 'w': 'هفته'}
@@ -94,43 +93,51 @@ min_cases: Optional[int] = None, max_cases: Optional[int] = None, min_mean_time:
         divisor = divisor_map.get(time_unit, 1)
         unit_label = unit_label_map.get(time_unit, 's')
 
-        edges_agg = edges_agg.with_columns([
-            (pl.col('Mean_Duration_Seconds') / divisor).alias('Weight_Value'),
-            (pl.col('Mean_Duration_Seconds') / divisor).round(2).cast(pl.Utf8).add(f" {unit_label}").alias('Edge_Label')
-        ])
+        weight_expr = pl.col('Mean_Duration_Seconds') / divisor
+        output_exprs += [
+            weight_expr.alias('Weight_Value'),
+            weight_expr.round(2).cast(pl.Utf8).add(f" {unit_label}").alias('Edge_Label')
+        ]
     else:
-        edges_agg = edges_agg.with_columns([
-            pl.col('Case_Count').alias('Weight_Value'),
+        output_exprs += [
+            # Float64 like the mean_time branch, so the edge table always matches EDGE_SCHEMA
+            pl.col('Case_Count').cast(pl.Float64).alias('Weight_Value'),
             pl.col('Case_Count').cast(pl.Int64).cast(pl.Utf8).alias('Edge_Label')
-        ])
+        ]
+
+    # All output columns in a single projection
+    edges_agg = edges_agg.with_columns(output_exprs)
 
     final_df = edges_agg.rename({'Source': 'Source_Activity', 'Target': 'Target_Activity'}).select([
         'Source_Activity', 'Target_Activity', 'Mean_Duration_Seconds',
         'Tooltip_Total_Time', 'Tooltip_Mean_Time', 'Weight_Value', 'Edge_Label', 'Case_Count'
     ])
 
-    # Apply filters
-    if min_cases is not None:
-        print(f"🔄 [GRAPH] Filtering: Case_Count >= {min_cases}")
-        final_df = final_df.filter(pl.col('Case_Count') >= min_cases)
-    if max_cases is not None:
-        print(f"🔄 [GRAPH] Filtering: Case_Count <= {max_cases}")
-        final_df = final_df.filter(pl.col('Case_Count') <= max_cases)
-    if min_mean_time is not None:
-        print(f"🔄 [GRAPH] Filtering: Mean_Duration_Seconds >= {min_mean_time}")
-        final_df = final_df.filter(pl.col('Mean_Duration_Seconds') >= min_mean_time)
-    if max_mean_time is not None:
-        print(f"🔄 [GRAPH] Filtering: Mean_Duration_Seconds <= {max_mean_time}")
-        final_df = final_df.filter(pl.col('Mean_Duration_Seconds') <= max_mean_time)
+    result_df = final_df.collect()
+    log.debug("generate_graph_from_variants complete: %d edges.", len(result_df))
+    return result_df
 
-    print("🔄 [GRAPH] Collecting final LazyFrame...")
-    try:
-        result_df = final_df.collect()
-        
-        print(f"✅ [GRAPH] generate_graph_from_variants complete. Returning DF with {len(result_df)} edges.")
-        print("=" * 60)
-        return result_df
 
-    except Exception as e:
-        print(f"❌ [GRAPH] Final collect FAILED: {e}")
-        raise
\ No newline at end of file
+def generate_graph_cached(variants_df: pl.DataFrame, cache_key: Optional[Hashable], weight_metric: str = 'cases', time_unit: str = 'd',
+min_cases: Optional[int] = None, max_cases: Optional[int] = None, min_mean_time: Optional[int] = None, max_mean_time: Optional[int] = None) -> pl.DataFrame:
+    """generate_graph_from_variants behind a small LRU keyed on `cache_key` and the filters.
+    
+    `cache_key` must identify the variant set (e.g. data version, time window and coverage);
+    with None the graph is always rebuilt. Hashing the frame itself costs about as much as
+    building the graph, so the key comes from the request inputs instead.
+    """
+    if cache_key is None or variants_df.is_empty():
+        return generate_graph_from_variants(variants_df, weight_metric, time_unit, min_cases, max_cases, min_mean_time, max_mean_time)
+
+    key = (cache_key, weight_metric, time_unit, min_cases, max_cases, min_mean_time, max_mean_time)
+    cached = _GRAPH_CACHE.get(key)
+    if cached is not None:
+        log.debug("generate_graph_cached: Cache hit, skipping graph generation.")
+        _GRAPH_CACHE.move_to_end(key)
+        return cached
+
+    result_df = generate_graph_from_variants(variants_df, weight_metric, time_unit, min_cases, max_cases, min_mean_time, max_mean_time)
+    _GRAPH_CACHE[key] = result_df
+    if len(_GRAPH_CACHE) > GRAPH_CACHE_SIZE:
+        _GRAPH_CACHE.popitem(last=False)
+    return result_df
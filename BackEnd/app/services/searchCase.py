@@ -1,30 +1,77 @@
 import polars as pl
-import bisect
-from typing import List, Dict, Tuple, Optional
+import numpy as np
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Sequence, Tuple, Optional, Union
+from app.config import ETL_CACHE_TTL
 
+# Sorted global case durations per ETL data version and window (see search_case_logic)
+DURATIONS_CACHE_SIZE = 16
+_DURATIONS_CACHE: "OrderedDict[Hashable, Tuple[float, np.ndarray]]" = OrderedDict()
 
-def get_case_position_stats(target_duration: float, all_durations: List[float]) -> Tuple[float, bool]:
+
+def get_case_position_stats(target_duration: float, all_durations: Union[np.ndarray, Sequence[float]], is_sorted: bool = False) -> Tuple[float, bool]:
     """Calculates percentile and average comparison."""
-    if not all_durations:
+    arr = np.asarray(all_durations, dtype=np.float64)
+    if arr.size == 0:
         return 0, False
     
-    # Bisect requires sorted list. In large scale, maybe cache this?
-    # For now, sorting here is safer.
-    all_durations.sort()
-    idx = bisect.bisect_left(all_durations, target_duration)
-    percentile = (idx / len(all_durations)) * 100
-    avg_duration = sum(all_durations) / len(all_durations)
+    if is_sorted:
+        idx = int(np.searchsorted(arr, target_duration, side='left'))
+    else:
+        # Counting the smaller durations gives the bisect_left position without sorting
+        idx = int((arr < target_duration).sum())
+    percentile = (idx / arr.size) * 100
+    avg_duration = arr.mean()
     
-    return percentile, target_duration > avg_duration
+    return percentile, bool(target_duration > avg_duration)
+
+def global_case_durations(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Lazy total duration of every case with more than one event."""
+    return lf.group_by('CaseID').agg([
+        (pl.col('Timestamp').max() - pl.col('Timestamp').min()).dt.total_seconds().alias('Total_Duration'),
+        pl.len().alias('Case_Length')
+    ]).filter(pl.col('Case_Length') > 1).select('Total_Duration')
+
+def _cached_durations(cache_key: Optional[Hashable]) -> Optional[np.ndarray]:
+    if cache_key is None or cache_key not in _DURATIONS_CACHE:
+        return None
+    stored_at, durations = _DURATIONS_CACHE[cache_key]
+    if time.monotonic() - stored_at >= ETL_CACHE_TTL:
+        del _DURATIONS_CACHE[cache_key]
+        return None
+    _DURATIONS_CACHE.move_to_end(cache_key)
+    return durations
 
-def search_case_logic(lf: pl.LazyFrame, target_case_id: int, df_global_context: Optional[pl.DataFrame] = None) -> Optional[Dict]:
-    """Finds a case and compares it to the global context."""
-    case_df = lf.filter(pl.col('CaseID') == pl.lit(target_case_id)).collect()
+def _store_durations(cache_key: Optional[Hashable], durations: np.ndarray) -> None:
+    if cache_key is None or ETL_CACHE_TTL <= 0:
+        return
+    _DURATIONS_CACHE[cache_key] = (time.monotonic(), durations)
+    if len(_DURATIONS_CACHE) > DURATIONS_CACHE_SIZE:
+        _DURATIONS_CACHE.popitem(last=False)
+
+def search_case_logic(lf: pl.LazyFrame, target_case_id: int, include_global_stats: bool = True,
+                      cache_key: Optional[Hashable] = None) -> Optional[Dict]:
+    """Finds a case and compares it to the global context.
+    
+    `cache_key` identifies the data behind `lf` (e.g. the ETL data version and time window); when
+    given, the sorted global durations are reused across lookups for up to ETL_CACHE_TTL seconds.
+    """
+    case_lf = lf.filter(pl.col('CaseID') == pl.lit(target_case_id))
+
+    global_durations = _cached_durations(cache_key) if include_global_stats else None
+    if include_global_stats and global_durations is None:
+        # One collect for both queries so the ETL scan is shared between them
+        case_df, global_agg = pl.collect_all([case_lf, global_case_durations(lf)], engine="streaming")
+        global_durations = np.sort(global_agg['Total_Duration'].drop_nulls().to_numpy())
+        _store_durations(cache_key, global_durations)
+    else:
+        case_df = case_lf.collect(engine="streaming")
 
     if case_df.is_empty():
         return None
 
-    case_df = case_df.sort('Timestamp')
+    # The ETL frame is sorted by (CaseID, Timestamp), so the case rows are already in order
     activities = case_df['Activity'].to_list()
     
     # Calculate edge durations
@@ -38,19 +85,13 @@ def search_case_logic(lf: pl.LazyFrame, target_case_id: int, df_global_context:
         total_duration = (case_df['Timestamp'][-1] - case_df['Timestamp'][0]).total_seconds()
 
     stats = {}
-    if df_global_context is not None:
-         global_agg = df_global_context.group_by('CaseID').agg([
-             (pl.col('Timestamp').max() - pl.col('Timestamp').min()).dt.total_seconds().alias('Total_Duration'),
-             pl.len().alias('Case_Length') 
-         ]).filter(pl.col('Case_Length') > 1)
-         
-         global_durations = global_agg['Total_Duration'].drop_nulls().to_list()
-         percentile, is_slower = get_case_position_stats(total_duration, global_durations)
-         
-         stats = {
-             "duration_percentile": round(percentile, 2),
-             "is_slower_than_average": is_slower
-         }
+    if global_durations is not None:
+        percentile, is_slower = get_case_position_stats(total_duration, global_durations, is_sorted=True)
+
+        stats = {
+            "duration_percentile": round(percentile, 2),
+            "is_slower_than_average": is_slower
+        }
 
     return {
         "nodes": activities,
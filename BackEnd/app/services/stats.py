@@ -1,67 +1,83 @@
 import polars as pl
 import numpy  as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 
 
-def calculate_histogram(values: List[float], bins: int = 30, is_integer: bool = False) -> Dict[str, List]:
-    """Calculates histogram bins and counts safely."""
-    if not values:
-        return {"bins": [], "counts": []}
-    
-    values_arr = np.array(values)
-
-    if is_integer:
-        min_v = int(values_arr.min())
-        max_v = int(values_arr.max())
-        unique_count = max_v - min_v + 1
-        
-        if unique_count < bins:
-            bin_edges = np.arange(min_v, max_v + 2)
-        else:
-            bin_edges = np.histogram_bin_edges(values_arr, bins=bins)
-            bin_edges = np.unique(np.round(bin_edges).astype(int))
-    else:
-        if values_arr.min() == values_arr.max():
-             val = values_arr.min()
-             if val == 0:
-                 bin_edges = np.linspace(-1, 1, bins + 1)
-             else:
-                 bin_edges = np.linspace(val * 0.9, val * 1.1, bins + 1)
-        else:
-            bin_edges = bins
-
+def _histogram_result(values_arr: np.ndarray, bin_edges) -> Dict[str, List]:
     hist, final_bin_edges = np.histogram(values_arr, bins=bin_edges)
-    
     return {
         "bins": final_bin_edges.tolist(),
         "counts": hist.tolist()
     }
 
-def get_global_statistics(df: pl.DataFrame) -> Dict[str, Any]:
+def hist_integer_counts(values: Union[np.ndarray, List[int]], bins: int = 30) -> Dict[str, List]:
+    """Histogram of integer values (e.g. case lengths); small ranges get one bin per value."""
+    values_arr = np.asarray(values)
+    if values_arr.size == 0:
+        return {"bins": [], "counts": []}
+
+    lo = values_arr.min()
+    hi = values_arr.max()
+    min_v = int(lo)
+    max_v = int(hi)
+    if max_v - min_v + 1 < bins:
+        bin_edges = np.arange(min_v, max_v + 2)
+    else:
+        bin_edges = np.histogram_bin_edges(values_arr, bins=bins, range=(lo, hi))
+        bin_edges = np.unique(np.round(bin_edges).astype(int))
+    return _histogram_result(values_arr, bin_edges)
+
+def hist_float(values: Union[np.ndarray, List[float]], bins: int = 30) -> Dict[str, List]:
+    """Histogram of continuous values (e.g. durations) over equal-width bins."""
+    values_arr = np.asarray(values)
+    if values_arr.size == 0:
+        return {"bins": [], "counts": []}
+
+    # min/max are computed once and handed to NumPy, which would otherwise scan again
+    min_v = values_arr.min()
+    max_v = values_arr.max()
+    if min_v == max_v:
+        if min_v == 0:
+            bin_edges = np.linspace(-1, 1, bins + 1)
+        else:
+            bin_edges = np.linspace(min_v * 0.9, min_v * 1.1, bins + 1)
+    else:
+        bin_edges = np.histogram_bin_edges(values_arr, bins=bins, range=(min_v, max_v))
+    return _histogram_result(values_arr, bin_edges)
+
+def get_global_statistics(df: Union[pl.DataFrame, pl.LazyFrame]) -> Dict[str, Any]:
     """Calculates global stats (Case Length & Duration)."""
-    case_stats = df.group_by('CaseID').agg([
+    case_stats = df.lazy().group_by('CaseID').agg([
         (pl.col('Timestamp').max() - pl.col('Timestamp').min()).dt.total_seconds().alias('Total_Duration'),
         pl.len().alias('Case_Length')
-    ]).filter(pl.col('Case_Length') > 1)
+    ]).filter(pl.col('Case_Length') > 1).collect(engine="streaming")
     
-    total_durations = case_stats['Total_Duration'].drop_nulls().to_list()
-    case_lengths = case_stats['Case_Length'].to_list()
+    # NumPy views of the Arrow columns, no per-element Python objects
+    total_durations = case_stats['Total_Duration'].drop_nulls().to_numpy()
+    case_lengths = case_stats['Case_Length'].to_numpy()
     
     return {
-        "total_time": calculate_histogram(total_durations, bins=40, is_integer=False),
-        "steps": calculate_histogram(case_lengths, bins=40, is_integer=True)
+        "total_time": hist_float(total_durations, bins=40),
+        "steps": hist_integer_counts(case_lengths, bins=40)
     }
 
-def get_single_edge_statistics(df: pl.DataFrame, source: str, target: str) -> Dict[str, List]:
-    """Calculates duration distribution for a specific edge."""
+def get_single_edge_statistics(df: Union[pl.DataFrame, pl.LazyFrame], source: str, target: str) -> Dict[str, List]:
+    """Calculates duration distribution for a specific edge.
+    
+    Expects the event log ordering produced by ETL.enrich_event_log (sorted by CaseID, Timestamp).
+    """
     # Pre-filter to minimal needed columns/rows to speed up
-    q = df.lazy().sort(['CaseID', 'Timestamp'])
+    q = df.lazy().select(['CaseID', 'Timestamp', 'Activity'])
+    # Rows are already in case order, so the next event is a plain shift; the CaseID check
+    # drops pairs that would cross into the next case (cheaper than shift().over('CaseID'))
     q = q.with_columns([
-        pl.col('Activity').shift(-1).over('CaseID').alias('Target_Activity'),
-        pl.col('Timestamp').shift(-1).over('CaseID').alias('Target_Timestamp')
+        pl.col('Activity').shift(-1).alias('Target_Activity'),
+        pl.col('Timestamp').shift(-1).alias('Target_Timestamp'),
+        pl.col('CaseID').shift(-1).alias('Next_CaseID')
     ])
 
     q = q.filter(
+        (pl.col('Next_CaseID') == pl.col('CaseID')) &
         (pl.col('Activity') == pl.lit(source)) & 
         (pl.col('Target_Activity') == pl.lit(target))
     )
@@ -73,6 +89,6 @@ def get_single_edge_statistics(df: pl.DataFrame, source: str, target: str) -> Di
     # Average per case ID to normalize
     durations = q.group_by('CaseID').agg(
         pl.col('Raw_Duration').mean().alias('Avg_Duration_Per_Case')
-    ).collect().get_column('Avg_Duration_Per_Case').to_list()
+    ).collect(engine="streaming").get_column('Avg_Duration_Per_Case').drop_nulls().to_numpy()
 
-    return calculate_histogram(durations, bins=30)
+    return hist_float(durations, bins=30)
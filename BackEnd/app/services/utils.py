@@ -1,6 +1,4 @@
 import polars as pl
-import numpy as np
-from typing import List, Any
 
 
 def format_seconds_to_days_expr(col_name: str) -> pl.Expr:
@@ -14,87 +12,43 @@ def format_seconds_to_days_expr(col_name: str) -> pl.Expr:
         .when(pl.col(col_name).is_null())
         .then(pl.lit(""))
         .otherwise(
-            pl.format("{} روز ", days.round(2))
+            # Fixed suffix: plain cast + concat instead of the generic formatter
+            pl.concat_str([days.round(2).cast(pl.Utf8), pl.lit(" روز ")])
         )
     )
 
-def safe_calc_list_stats(times_series: pl.Series, func: Any) -> List[List[float]]:
+def elementwise_list_stats(df_lazy: pl.LazyFrame, list_col: str = 'Times_List') -> pl.LazyFrame:
     """
-    Helper to calculate stats (mean/sum) on a list of lists using NumPy.
+    Element-wise mean/sum over a list-of-lists column, computed with Polars kernels.
     
-    IMPORTANT: times_series contains nested lists - each element is a list of lists,
-    where each inner list represents the timing data from one case.
+    Each row of `list_col` holds one timing list per case, e.g. [[0, 100, 300], [0, 120, 280]].
+    The rows are flattened to (row, case, position) values, aggregated per (row, position)
+    and gathered back into lists, adding 'Avg_Timings' and 'Total_Timings' columns.
     
-    For example, if 3 cases share the same variant with activities [A, B, C]:
-    - Case 1: [0, 100, 300] (times at each activity)
-    - Case 2: [0, 120, 280]
-    - Case 3: [0, 90, 350]
-    
-    We need to compute element-wise mean: [0, 103.33, 310]
+    Both are rounded with Polars' round(2), which does not match Python's round() on every
+    value that sits on a .xx5 boundary (2.675 -> 2.68 here but 2.67 in Python, 7.785 -> 7.78
+    here but 7.79), so such values can differ from the old NumPy path in the last digit.
     """
-    print(f"🔍 [UTILS] safe_calc_list_stats: Processing {len(times_series)} rows...")
-    
-    rows = times_series.to_list()
-    results = []
-    
-    for idx, case_times_list in enumerate(rows):
-        # case_times_list is a list of lists, e.g. [[0, 100, 300], [0, 120, 280], [0, 90, 350]]
-        if not case_times_list:
-            print(f"   [UTILS] Row {idx}: Empty list, appending []")
-            results.append([])
-            continue
-        
-        try:
-            # Debug: show structure of first few rows
-            if idx < 3:
-                print(f"   [UTILS] Row {idx}: Got {len(case_times_list)} cases, first case has {len(case_times_list[0]) if case_times_list and case_times_list[0] else 0} times")
-            
-            # Filter out empty inner lists and get only lists with matching lengths
-            valid_lists = [lst for lst in case_times_list if lst and len(lst) > 0]
-            
-            if not valid_lists:
-                print(f"   [UTILS] Row {idx}: No valid inner lists found, appending []")
-                results.append([])
-                continue
-            
-            # Find the most common length (the expected path length)
-            lengths = [len(lst) for lst in valid_lists]
-            if not lengths:
-                results.append([])
-                continue
-                
-            # Use the most common length
-            from collections import Counter
-            most_common_length = Counter(lengths).most_common(1)[0][0]
-            
-            # Filter to only lists with the most common length
-            matching_lists = [lst for lst in valid_lists if len(lst) == most_common_length]
-            
-            if not matching_lists:
-                results.append([])
-                continue
-            
-            # Now we can safely create a 2D numpy array
-            arr = np.array(matching_lists, dtype=np.float64)
-            
-            if arr.size > 0 and arr.ndim == 2:
-                res = func(arr, axis=0).tolist()
-                if not isinstance(res, list):
-                    res = [res]
-                results.append([round(x, 2) for x in res])
-            else:
-                # 1D array (single case) - just use the values directly
-                if arr.ndim == 1:
-                    results.append([round(x, 2) for x in arr.tolist()])
-                else:
-                    results.append([])
-                    
-        except Exception as e:
-            print(f"❌ [UTILS] Row {idx}: Exception: {e}")
-            results.append([])
-    
-    # Summary
-    non_empty = sum(1 for r in results if len(r) > 0)
-    print(f"✅ [UTILS] safe_calc_list_stats: Done. {non_empty}/{len(results)} rows have non-empty results.")
-    
-    return results
\ No newline at end of file
+    # cache(): both sides of the join must see the same row numbering. A lazy group_by input
+    # that was evaluated once per branch could come out in a different order each time.
+    indexed = df_lazy.with_row_index('_row').cache()
+    stats = (
+        indexed
+        .select(['_row', list_col])
+        .explode(list_col)
+        .with_columns(pl.int_ranges(pl.col(list_col).list.len()).alias('_pos'))
+        .explode([list_col, '_pos'])
+        .group_by(['_row', '_pos'])
+        .agg([
+            pl.col(list_col).mean().round(2).alias('Avg_Timings'),
+            pl.col(list_col).sum().round(2).alias('Total_Timings')
+        ])
+        .sort(['_row', '_pos'])
+        .group_by('_row', maintain_order=True)
+        .agg(['Avg_Timings', 'Total_Timings'])
+    )
+    return (
+        indexed
+        .join(stats, on='_row', how='left', maintain_order='left')
+        .drop('_row')
+    )
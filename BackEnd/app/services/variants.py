@@ -1,110 +1,68 @@
+import logging
 import polars as pl
-from typing import List
-import numpy as np
-from app.services.utils import safe_calc_list_stats
+from typing import Union
+from app.services.utils import elementwise_list_stats
 
+log = logging.getLogger(__name__)
+
+# Aggregation lists are built once at import and reused by every request
+_CASE_AGG = [
+    pl.col('Activity').alias('Variant_Path'),
+    pl.col('Seconds_From_Start').cast(pl.Float64).alias('Times_List')
+]
+
+_VAR_AGG = [
+    pl.col('Variant_Path').first(),
+    pl.len().alias('Frequency'),
+    pl.col('Times_List'),
+    # Every case of the filtered log starts at its first event and ends at its last one,
+    # so both counts are the case count
+    pl.len().cast(pl.UInt32).alias('True_Start_Count'),
+    pl.len().cast(pl.UInt32).alias('True_End_Count')
+]
 
 
 def calculate_case_aggregations(df_lazy: pl.LazyFrame) -> pl.LazyFrame:
     """Groups by CaseID to create variant paths and timing lists."""
-    print("🔄 [VARIANTS] calculate_case_aggregations: Grouping by CaseID...")
-    result = df_lazy.group_by('CaseID').agg([
-        pl.col('Activity').alias('Variant_Path'),
-        pl.col('Seconds_From_Start').alias('Times_List'),
-        (pl.col('Event_Rank').first() == 1).cast(pl.Int32).alias('Is_True_Start'),
-        (pl.col('Event_Rank').last() == pl.col('Max_Rank').first()).cast(pl.Int32).alias('Is_True_End')
-    ])
-    print("✅ [VARIANTS] calculate_case_aggregations: Done.")
+    result = df_lazy.group_by('CaseID').agg(_CASE_AGG).with_columns(
+        # Fixed-width key for the variant group_by (a 64-bit collision is practically impossible)
+        pl.col('Variant_Path').hash().alias('Variant_Hash')
+    )
     return result
 
-def calculate_variant_frequencies(cases_agg: pl.LazyFrame) -> pl.DataFrame:
+def calculate_variant_frequencies(cases_agg: pl.LazyFrame) -> pl.LazyFrame:
     """Aggregates cases into unique variants and counts frequencies."""
-    print("🔄 [VARIANTS] calculate_variant_frequencies: Aggregating variants...")
-    variants_agg = cases_agg.group_by('Variant_Path').agg([
-        pl.len().alias('Frequency'),
-        pl.col('Times_List'),
-        pl.col('Is_True_Start').sum().alias('True_Start_Count'),
-        pl.col('Is_True_End').sum().alias('True_End_Count')
-    ])
+    # Single-event cases are dropped before grouping (every case of a variant has its path length);
+    # grouping on the path hash avoids hashing and comparing the lists themselves
+    variants_agg = cases_agg.filter(pl.col('Variant_Path').list.len() > 1).group_by('Variant_Hash').agg(_VAR_AGG)
 
-    # Must collect here to perform list length filtering and cumulative sums efficiently
-    print("🔄 [VARIANTS] Collecting variants DataFrame...")
-    variants_df = variants_agg.collect()
-    print(f"   [VARIANTS] Collected {variants_df.shape[0]} unique variants before filtering.")
-    
-    filtered_df = variants_df.filter(pl.col('Variant_Path').list.len() > 1)
-    print(f"✅ [VARIANTS] calculate_variant_frequencies: {filtered_df.shape[0]} variants after filtering (path length > 1).")
-    return filtered_df
+    return variants_agg.drop('Variant_Hash')
 
-def compute_coverage_and_sort(variants_df: pl.DataFrame) -> pl.DataFrame:
+def compute_coverage_and_sort(variants_lf: pl.LazyFrame) -> pl.LazyFrame:
     """Adds Percentage and Cumulative Coverage columns."""
-    print("🔄 [VARIANTS] compute_coverage_and_sort: Computing coverage...")
-    if variants_df.is_empty():
-        print("⚠️ [VARIANTS] DataFrame is empty, returning as-is.")
-        return variants_df
-
-    total_cases = variants_df['Frequency'].sum()
-    print(f"   [VARIANTS] Total cases: {total_cases}")
-    
-    variants_df = variants_df.with_columns(
-        (pl.col('Frequency') / total_cases * 100).alias('Percentage')
-    ).sort('Frequency', descending=True)
-
-    variants_df = variants_df.with_columns(
-        (pl.col('Percentage').cum_sum() / 100).alias('cum_coverage')
-    )
-    print("✅ [VARIANTS] compute_coverage_and_sort: Done.")
-    return variants_df
-
-def enrich_variants_with_timings(variants_df: pl.DataFrame) -> pl.DataFrame:
-    """Calculates Avg and Total timings for variants using numpy."""
-    print("🔄 [VARIANTS] enrich_variants_with_timings: Calculating timings...")
-    if variants_df.is_empty():
-        print("⚠️ [VARIANTS] DataFrame is empty, returning with empty timing columns.")
-        return variants_df.with_columns([
-             pl.lit([]).alias('Avg_Timings'),
-             pl.lit([]).alias('Total_Timings')
-        ])
-
-    print(f"   [VARIANTS] Processing {variants_df.shape[0]} variants...")
-    avg_timings = safe_calc_list_stats(variants_df['Times_List'], np.mean)
-    total_timings = safe_calc_list_stats(variants_df['Times_List'], np.sum)
+    total_cases = pl.col('Frequency').sum()
     
-    # Debug: Check lengths
-    print(f"   [VARIANTS] Sample Variant_Path lengths: {variants_df.head(5).select(pl.col('Variant_Path').list.len()).to_series().to_list()}")
-    print(f"   [VARIANTS] Sample Avg_Timings lengths: {[len(x) for x in avg_timings[:5]]}")
-
-    result = variants_df.with_columns([
-        pl.Series(avg_timings).alias('Avg_Timings'),
-        pl.Series(total_timings).alias('Total_Timings')
+    # Both columns come straight from Frequency in one projection; Percentage is kept
+    # only because it is part of the exported variant schema
+    return variants_lf.sort('Frequency', descending=True).with_columns([
+        (pl.col('Frequency') / total_cases * 100).alias('Percentage'),
+        (pl.col('Frequency').cum_sum() / total_cases).alias('cum_coverage')
     ])
-    
-    # Verify lengths match
-    mismatch_check = result.select(
-        (pl.col('Variant_Path').list.len() != pl.col('Avg_Timings').list.len()).sum().alias('mismatches')
-    ).item()
-    if mismatch_check > 0:
-        print(f"⚠️ [VARIANTS] WARNING: {mismatch_check} rows have mismatched Variant_Path/Avg_Timings lengths!")
-    else:
-        print("   [VARIANTS] All Variant_Path and Avg_Timings lengths match ✓")
-    
-    print("✅ [VARIANTS] enrich_variants_with_timings: Done.")
-    return result
 
-def extract_nodes_heatmap(variants_df: pl.DataFrame, node_type: str, count_col: str, coverage: float = 0.95) -> List[str]:
-    """Calculates top nodes utilizing fast Polars group_by operations instead of iter_rows."""
-    print(f"🔄 [VARIANTS] extract_nodes_heatmap: Extracting {node_type} nodes (Polars Optimized)...")
-    
-    if variants_df.is_empty():
-        return []
+def enrich_variants_with_timings(variants_lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Plans element-wise Avg and Total timings for variants in Polars."""
+    # Times_List is only needed by the stats subplan, so the result never carries it
+    return elementwise_list_stats(variants_lf, 'Times_List').drop('Times_List')
 
+def nodes_heatmap_query(variants_df: Union[pl.DataFrame, pl.LazyFrame], node_type: str, count_col: str, coverage: float = 0.95) -> pl.LazyFrame:
+    """Lazy query for the top start/end nodes covering `coverage` of the true starts/ends."""
     # انتخاب نود اول یا آخر با استفاده از متدهای list
     target_index = 0 if node_type == 'start' else -1
     
     # 1. استخراج نودها و تعدادشان
-    nodes_agg = (
+    return (
         variants_df
-        .filter(pl.col(count_col) > 0)
+        .lazy()
         .select([
             pl.col('Variant_Path').list.get(target_index).alias('Node'),
             pl.col(count_col)
@@ -112,47 +70,25 @@ def extract_nodes_heatmap(variants_df: pl.DataFrame, node_type: str, count_col:
         .group_by('Node')
         .agg(pl.col(count_col).sum().alias('Total_Count'))
         .sort('Total_Count', descending=True)
-    )
-
-    if nodes_agg.is_empty():
-        return []
-
-    total_count = nodes_agg['Total_Count'].sum()
-    nodes_agg = nodes_agg.with_columns(
-        (pl.col('Total_Count').cum_sum() / total_count).alias('Running_Coverage')
-    )
-
-    selected_nodes = (
-        nodes_agg
+        # 2. پوشش تجمعی و انتخاب نودها تا رسیدن به آستانه
+        .with_columns(
+            (pl.col('Total_Count').cum_sum() / pl.col('Total_Count').sum()).alias('Running_Coverage')
+        )
         .filter(
             (pl.col('Running_Coverage').shift(1, fill_value=0.0) < coverage)
         )
         .select('Node')
-        .to_series()
-        .to_list()
     )
 
-    print(f"✅ [VARIANTS] extract_nodes_heatmap: Found {len(selected_nodes)} {node_type} nodes.")
-    return selected_nodes
-
 def get_variants_logic(df_lazy: pl.LazyFrame, target_coverage: float = 0.95):
-    print("=" * 60)
-    print("🚀 [VARIANTS] get_variants_logic: Starting...")
-    
-    # 1. Aggregation
-    cases_agg = calculate_case_aggregations(df_lazy)
-    variants_df = calculate_variant_frequencies(cases_agg)
-
-    if variants_df.is_empty():
-        return pl.DataFrame(), pl.DataFrame(), [], []
+    log.debug("get_variants_logic: target_coverage=%s", target_coverage)
 
-    # 2. Compute Coverage
-    variants_df = compute_coverage_and_sort(variants_df)
-
-    # 3. Enrich with Timings
-    variants_df = enrich_variants_with_timings(variants_df)
+    # 1. Aggregation + 2. Coverage + 3. Timings, all planned as one lazy query
+    cases_agg = calculate_case_aggregations(df_lazy)
+    variants_lf = compute_coverage_and_sort(calculate_variant_frequencies(cases_agg))
+    variants_lf = enrich_variants_with_timings(variants_lf)
 
-    # 4. 🔥 CLEANUP & RECHUNK 🔥
+    # 4. 🔥 CLEANUP 🔥
     wanted_columns = [
         'Variant_Path', 
         'Frequency', 
@@ -164,37 +100,36 @@ def get_variants_logic(df_lazy: pl.LazyFrame, target_coverage: float = 0.95):
         'Total_Timings'
     ]
     
-    print(f"✂️ [VARIANTS] Selecting columns: {wanted_columns}")
-    
-    available_cols = variants_df.columns
-    cols_to_select = [c for c in wanted_columns if c in available_cols]
-    
-    # انتخاب ستون‌ها
-    variants_df_clean = variants_df.select(cols_to_select)
-    
-    # 🛑🛑🛑 نکته طلایی اینجاست: rechunk() 🛑🛑🛑
-    # این دستور باعث می‌شود Polars حافظه را از نو بسازد و دیتای اضافی (Times_List) را فیزیکی دور بریزد.
-    print("🧹 [VARIANTS] Re-chunking DataFrame to release unused memory...")
-    variants_df_clean = variants_df_clean.rechunk()
-
-    # دیباگ سایز
-    est_size_mb = variants_df_clean.estimated_size() / (1024 * 1024)
-    print(f"📉 [VARIANTS] Clean DataFrame Size: {est_size_mb:.2f} MB | Shape: {variants_df_clean.shape}")
+    # انتخاب ستون‌ها (مسیرها برای خروجی Arrow/JS دوباره به String تبدیل می‌شوند)
+    # cache(): the four outputs below share this subplan, so it is executed only once
+    full_lf = variants_lf.select(wanted_columns).with_columns(
+        pl.col('Variant_Path').cast(pl.List(pl.String))
+    ).cache()
 
     # 5. Prepare Outputs
-    cutoff_row = variants_df_clean.filter(pl.col('cum_coverage') >= target_coverage).head(1)
-    
-    if not cutoff_row.is_empty():
-        limit_val = cutoff_row['cum_coverage'][0]
-        pareto_variants_df = variants_df_clean.filter(pl.col('cum_coverage') <= limit_val)
-    else:
-        pareto_variants_df = variants_df_clean
-
-    # 6. Extract Nodes
-    start_nodes = extract_nodes_heatmap(pareto_variants_df, 'start', 'True_Start_Count')
-    end_nodes = extract_nodes_heatmap(pareto_variants_df, 'end', 'True_End_Count')
-
-    print(f"✅ [VARIANTS] Complete.")
-    print("=" * 60)
+    # A variant is in the pareto set while the coverage before it is still below the target,
+    # i.e. up to and including the first variant that reaches it (the first row is always kept)
+    in_pareto = (pl.col('cum_coverage').shift(1) < target_coverage).fill_null(True)
+    pareto_lf = full_lf.filter(in_pareto)
+
+    # 6. Single materialization: the shared aggregation/timings subplan runs once for all outputs
+    variants_df_clean, pareto_variants_df, start_nodes_df, end_nodes_df = pl.collect_all([
+        full_lf,
+        pareto_lf,
+        nodes_heatmap_query(pareto_lf, 'start', 'True_Start_Count'),
+        nodes_heatmap_query(pareto_lf, 'end', 'True_End_Count')
+    ])
+
+    if variants_df_clean.is_empty():
+        return pl.DataFrame(), pl.DataFrame(), [], []
+
+    # دیباگ سایز (estimated_size روی همه‌ی بافرها پیمایش می‌کند، پس فقط در حالت debug)
+    if log.isEnabledFor(logging.DEBUG):
+        est_size_mb = variants_df_clean.estimated_size() / (1024 * 1024)
+        log.debug("Clean DataFrame Size: %.2f MB | Shape: %s", est_size_mb, variants_df_clean.shape)
+
+    start_nodes = start_nodes_df.to_series().to_list()
+    end_nodes = end_nodes_df.to_series().to_list()
+    log.debug("get_variants_logic: %d variants, %d start nodes, %d end nodes.", variants_df_clean.height, len(start_nodes), len(end_nodes))
     
     return pareto_variants_df, variants_df_clean, start_nodes, end_nodes
\ No newline at end of file
@@ -280,7 +280,8 @@ export const api = {
   graph: {
     /**
      * Fetch graph data with filters
-     * Returns zstd-compressed MsgPack container with Arrow IPC tables
+     * Returns MsgPack container with Arrow IPC tables (zstd-compressed unless
+     * the backend compresses the Arrow buffers directly)
      */
     getData: async (filters: Partial<FilterTypes>): Promise<ProcessMiningData> => {
       // Calculate target_coverage from outlierPrecentage
@@ -314,10 +315,13 @@ export const api = {
         );
       }
       
-      // Get raw bytes and decompress
-      const compressedData = new Uint8Array(await response.arrayBuffer());
-      const fzstd = await import("fzstd");
-      const decompressedData = fzstd.decompress(compressedData);
+      // Get raw bytes and decompress (the backend skips zstd when Arrow IPC is compressed itself)
+      const contentType = response.headers.get("Content-Type") ?? "";
+      let decompressedData: Uint8Array = new Uint8Array(await response.arrayBuffer());
+      if (contentType.includes("zstd")) {
+        const fzstd = await import("fzstd");
+        decompressedData = fzstd.decompress(decompressedData);
+      }
       
       // Decode msgpack container
       const container = msgpack.decode(decompressedData) as {